@@ -1,76 +1,453 @@
 import json
 import os
 import tempfile
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
+from PIL.PngImagePlugin import PngInfo
 from utils.logger import get_logger
 from utils.s3 import S3Client
 
 logger = get_logger(__name__)
 
+# Default number of pages rendered by a single shard invocation
+DEFAULT_PAGES_PER_SHARD = int(os.getenv('PAGES_PER_SHARD', '50'))
+
+# "fixed" renders every page at DEFAULT_DPI, "adaptive" picks a DPI per page
+DEFAULT_DPI_MODE = os.getenv('RENDER_DPI_MODE', 'fixed')
+DEFAULT_DPI = 200
+
+# Adaptive rendering limits
+PREVIEW_DPI = 72  # One preview pixel per point keeps the analysis cheap
+MIN_DPI = 100
+MAX_DPI = int(os.getenv('MAX_RENDER_DPI', '300'))
+QR_MIN_DPI = 150  # Keeps QR modules several pixels wide for pyzbar
+DPI_STEP = 25
+
+# Line pitch (baseline to baseline) in rendered pixels that adaptive mode aims
+# for; 12pt text on 14pt leading lands here at DEFAULT_DPI
+TARGET_LINE_PITCH_PX = 40
+
+# Plausible line pitch range in preview pixels (points at PREVIEW_DPI)
+MIN_LINE_PITCH_PX = 3
+MAX_LINE_PITCH_PX = 48
+
+# Minimum normalised autocorrelation for the row profile to count as text lines
+MIN_LINE_PERIODICITY = 0.2
+
 def lambda_handler(event, context):
     """
     Convert PDF pages to PNG images
-    
+
     Expected event format:
     {
         "bucket": "bucket-name",
-        "key": "path/to/file.pdf"
+        "key": "path/to/file.pdf",
+        "mode": "full" | "plan" | "shard" | "merge" | "rerender",  # optional, defaults to "full"
+        "dpi_mode": "fixed" | "adaptive",              # optional, defaults to RENDER_DPI_MODE
+        "pages_per_shard": 50,                         # optional, plan mode only
+        "first_page": 1,                               # shard mode only
+        "last_page": 50,                               # shard mode only
+        "shard_results": [...],                        # merge mode only
+        "page": 3,                                     # rerender mode only
+        "dpi": 300                                     # rerender mode only
     }
-    
-    Returns:
+
+    Returns (full, shard, merge and rerender modes):
     {
         "bucket": "bucket-name",
         "key": "original-key",
         "images": ["image1.png", "image2.png", ...]
     }
+
+    Rerender mode uploads to a separate "page_N_<dpi>dpi.png" key and leaves
+    the original page image in place.
+
+    Returns (plan mode):
+    {
+        "bucket": "bucket-name",
+        "key": "original-key",
+        "page_count": 120,
+        "shards": [
+            {"mode": "shard", "bucket": "...", "key": "...", "first_page": 1, "last_page": 50},
+            ...
+        ]
+    }
     """
+    mode = event.get('mode', 'full')
+
     try:
+        if mode == 'merge':
+            return merge_shards(event)
+
         bucket = event['bucket']
         key = event['key']
-        
-        logger.info(f"Processing PDF: {bucket}/{key}")
-        
+
+        logger.info(f"Processing PDF ({mode}): {bucket}/{key}")
+
         s3_client = S3Client()
-        
+
         # Create temporary directory
         with tempfile.TemporaryDirectory() as temp_dir:
             # Download PDF
             pdf_path = os.path.join(temp_dir, 'input.pdf')
             if not s3_client.download_file(bucket, key, pdf_path):
                 raise Exception(f"Failed to download PDF from {bucket}/{key}")
-            
-            # Convert PDF pages to images using pdf2image
-            images = convert_from_path(pdf_path, dpi=200)  # High quality conversion
-            image_keys = []
-            
-            for page_num, image in enumerate(images):
-                # Save image locally
-                image_filename = f"page_{page_num + 1}.png"
-                image_path = os.path.join(temp_dir, image_filename)
-                image.save(image_path, 'PNG')
-                
-                # Upload image to S3
-                base_key = key.rsplit('.', 1)[0]  # Remove .pdf extension
-                image_key = f"{base_key}/images/{image_filename}"
-                
-                if s3_client.upload_file(image_path, bucket, image_key):
-                    image_keys.append(image_key)
-                    logger.info(f"Uploaded image: {bucket}/{image_key}")
-                else:
-                    logger.error(f"Failed to upload image: {image_key}")
-            
+
+            if mode == 'plan':
+                return plan_shards(event, pdf_path)
+
+            dpi_mode = event.get('dpi_mode') or DEFAULT_DPI_MODE
+            dpi = DEFAULT_DPI
+            suffix = ''
+
+            if mode == 'shard':
+                first_page = int(event['first_page'])
+                last_page = int(event['last_page'])
+            elif mode == 'full':
+                first_page = None
+                last_page = None
+            elif mode == 'rerender':
+                # Re-renders use the requested DPI and are not re-analysed
+                first_page = last_page = int(event['page'])
+                dpi_mode = 'fixed'
+                dpi = min(int(event['dpi']), MAX_DPI)
+                suffix = f"_{dpi}dpi"
+            else:
+                raise Exception(f"Unsupported mode: {mode}")
+
+            image_keys = render_pages(
+                s3_client, bucket, key, pdf_path, temp_dir,
+                first_page=first_page, last_page=last_page,
+                dpi_mode=dpi_mode, dpi=dpi, suffix=suffix
+            )
+
+            # A shard missing pages would leave gaps in the merged document
+            if mode == 'shard' and len(image_keys) != last_page - first_page + 1:
+                raise Exception(
+                    f"Uploaded {len(image_keys)} of {last_page - first_page + 1} pages "
+                    f"for shard {first_page}-{last_page}"
+                )
+
             logger.info(f"Successfully converted {len(image_keys)} pages to images")
-            
-            return {
+
+            result = {
                 'statusCode': 200,
                 'bucket': bucket,
                 'key': key,
                 'images': image_keys
             }
-            
+            if mode == 'shard':
+                result['first_page'] = first_page
+                result['last_page'] = last_page
+
+            return result
+
     except Exception as e:
         logger.error(f"Error processing PDF: {str(e)}")
+
+        # Plan, shard and merge run as Step Function tasks; raising lets the
+        # state machine retry transient errors and fail with the real cause
+        if mode in ('plan', 'shard', 'merge'):
+            raise
+
         return {
             'statusCode': 500,
             'error': str(e)
         }
+
+def render_pages(s3_client, bucket, key, pdf_path, temp_dir, first_page=None, last_page=None,
+                 dpi_mode='fixed', dpi=DEFAULT_DPI, suffix=''):
+    """
+    Render a page range of a PDF to PNG and upload each page to S3
+
+    Pages are rendered and uploaded one at a time so memory and /tmp usage
+    stay bounded by a single page regardless of the range size.
+
+    Args:
+        s3_client: S3Client instance
+        bucket: S3 bucket name
+        key: S3 key of the source PDF
+        pdf_path: Local path of the downloaded PDF
+        temp_dir: Directory for intermediate image files
+        first_page: First page to render (1-based, inclusive), None for the start
+        last_page: Last page to render (1-based, inclusive), None for the end
+        dpi_mode: "fixed" to render at dpi, "adaptive" to choose a DPI per page
+        dpi: Render resolution in fixed mode
+        suffix: Appended to the page file name, e.g. "_300dpi" for re-renders
+
+    Returns:
+        List of uploaded image keys in page order
+    """
+    if dpi_mode not in ('fixed', 'adaptive'):
+        raise Exception(f"Unsupported dpi_mode: {dpi_mode}")
+
+    first_page = first_page or 1
+    if last_page is None:
+        last_page = int(pdfinfo_from_path(pdf_path)['Pages'])
+
+    image_keys = []
+
+    for page_num in range(first_page, last_page + 1):
+        render_dpi = dpi
+        if dpi_mode == 'adaptive':
+            # Analyse a cheap grayscale preview to pick this page's DPI
+            preview = render_page(pdf_path, page_num, PREVIEW_DPI, grayscale=True)
+            render_dpi = choose_render_dpi(preview)
+            preview.close()
+
+        image = render_page(pdf_path, page_num, render_dpi)
+        image_key = save_and_upload(
+            s3_client, bucket, key, temp_dir, image,
+            page_num, render_dpi, dpi_mode, suffix
+        )
+        image.close()
+
+        if image_key:
+            image_keys.append(image_key)
+
+    return image_keys
+
+def render_page(pdf_path, page_num, dpi, grayscale=False):
+    """
+    Render a single PDF page with pdf2image
+
+    Returns:
+        PIL image of the page
+    """
+    return convert_from_path(
+        pdf_path,
+        dpi=dpi,
+        first_page=page_num,
+        last_page=page_num,
+        grayscale=grayscale
+    )[0]
+
+def save_and_upload(s3_client, bucket, key, temp_dir, image, page_num, dpi, dpi_mode, suffix=''):
+    """
+    Save a rendered page as PNG and upload it to S3
+
+    The render DPI, DPI mode, source PDF key and page number are embedded in
+    the PNG so downstream steps can re-render the page without extra state.
+
+    Returns:
+        Uploaded image key, or None if the upload failed
+    """
+    # Save image locally
+    image_filename = f"page_{page_num}{suffix}.png"
+    image_path = os.path.join(temp_dir, image_filename)
+
+    png_info = PngInfo()
+    png_info.add_text('source_key', key)
+    png_info.add_text('page', str(page_num))
+    png_info.add_text('dpi_mode', dpi_mode)
+    image.save(image_path, 'PNG', dpi=(dpi, dpi), pnginfo=png_info)
+
+    # Upload image to S3
+    base_key = key.rsplit('.', 1)[0]  # Remove .pdf extension
+    image_key = f"{base_key}/images/{image_filename}"
+
+    uploaded = s3_client.upload_file(image_path, bucket, image_key)
+    os.remove(image_path)
+
+    if uploaded:
+        logger.info(f"Uploaded image at {dpi} DPI: {bucket}/{image_key}")
+        return image_key
+
+    logger.error(f"Failed to upload image: {image_key}")
+    return None
+
+def choose_render_dpi(preview):
+    """
+    Choose a render DPI for a page from its low-resolution preview
+
+    Args:
+        preview: Grayscale page image rendered at PREVIEW_DPI
+
+    Returns:
+        DPI to render the page at
+    """
+    gray = preview.convert('L')
+    width, height = gray.size
+    ink = [1 if value < 128 else 0 for value in gray.getdata()]
+
+    line_pitch = estimate_line_pitch(ink, width, height)
+    has_qr = has_qr_like_region(ink, width, height)
+
+    if line_pitch:
+        # Scale so a typical text line lands near TARGET_LINE_PITCH_PX
+        dpi = TARGET_LINE_PITCH_PX * PREVIEW_DPI / line_pitch
+        dpi = -(-int(dpi) // DPI_STEP) * DPI_STEP  # Round up to the next step
+        dpi = max(MIN_DPI, min(dpi, MAX_DPI))
+    else:
+        # No measurable line spacing, e.g. a photo, a scan or text too dense
+        # to resolve in the preview; never scale down on a guess
+        dpi = DEFAULT_DPI
+
+    if has_qr:
+        dpi = max(dpi, QR_MIN_DPI)
+
+    logger.info(f"Chose {dpi} DPI (line pitch {line_pitch}px at {PREVIEW_DPI} DPI, QR: {has_qr})")
+    return dpi
+
+def estimate_line_pitch(ink, width, height):
+    """
+    Estimate the text line pitch from the periodicity of the row ink profile
+
+    Tightly leaded lines often leave no blank row between them at preview
+    resolution, but the ink per row still rises and falls once per line, so
+    the first strong autocorrelation peak gives the line pitch.
+
+    Args:
+        ink: Row-major list of 1 (ink) / 0 (paper) pixels
+        width: Image width in pixels
+        height: Image height in pixels
+
+    Returns:
+        Line pitch in pixels, or None if no regular line structure was found
+    """
+    min_ink = max(1, int(width * 0.002))
+    row_ink = [sum(ink[y * width:(y + 1) * width]) for y in range(height)]
+
+    inked_rows = [y for y, count in enumerate(row_ink) if count >= min_ink]
+    if not inked_rows:
+        return None
+
+    profile = row_ink[inked_rows[0]:inked_rows[-1] + 1]
+    mean = sum(profile) / len(profile)
+    centered = [count - mean for count in profile]
+    energy = sum(value * value for value in centered)
+    if not energy:
+        return None
+
+    # Require at least three periods so a couple of lines don't count as text
+    max_lag = min(MAX_LINE_PITCH_PX, len(centered) // 3)
+    scores = {}
+    for lag in range(MIN_LINE_PITCH_PX - 1, max_lag + 2):
+        if 0 < lag < len(centered):
+            scores[lag] = sum(
+                centered[i] * centered[i + lag] for i in range(len(centered) - lag)
+            ) / energy
+
+    candidates = [
+        lag for lag in range(MIN_LINE_PITCH_PX, max_lag + 1)
+        if scores[lag] >= scores.get(lag - 1, 0) and scores[lag] >= scores.get(lag + 1, 0)
+    ]
+    if not candidates:
+        return None
+
+    best = max(scores[lag] for lag in candidates)
+    if best < MIN_LINE_PERIODICITY:
+        return None
+
+    # The fundamental is the first peak close to the strongest one
+    for lag in candidates:
+        if scores[lag] >= 0.8 * best:
+            return lag
+
+    return None
+
+def has_qr_like_region(ink, width, height):
+    """
+    Detect square regions with the dense, gap-free ink pattern of a QR code
+
+    Text leaves blank rows between lines and has low ink coverage, while a
+    QR code is roughly half ink with transitions on every row and column.
+
+    Returns:
+        True if at least one QR-like tile was found
+    """
+    tile = max(8, int(PREVIEW_DPI * 0.4))
+
+    for top in range(0, height - tile + 1, tile // 2):
+        for left in range(0, width - tile + 1, tile // 2):
+            rows = [ink[(top + y) * width + left:(top + y) * width + left + tile] for y in range(tile)]
+
+            coverage = sum(sum(row) for row in rows) / (tile * tile)
+            if not 0.3 <= coverage <= 0.7:
+                continue
+
+            if not all(any(row) for row in rows):
+                continue
+            if not all(any(row[x] for row in rows) for x in range(tile)):
+                continue
+
+            transitions = sum(
+                sum(1 for x in range(1, tile) if row[x] != row[x - 1]) for row in rows
+            )
+            if transitions / tile >= 4:
+                return True
+
+    return False
+
+def plan_shards(event, pdf_path):
+    """
+    Split a PDF into page-range shards that can be rendered concurrently
+
+    Args:
+        event: Original plan event (bucket, key, optional pages_per_shard)
+        pdf_path: Local path of the downloaded PDF
+
+    Returns:
+        Dict with page count and the list of shard events
+    """
+    bucket = event['bucket']
+    key = event['key']
+    dpi_mode = event.get('dpi_mode') or DEFAULT_DPI_MODE
+    pages_per_shard = int(event.get('pages_per_shard') or DEFAULT_PAGES_PER_SHARD)
+    if pages_per_shard < 1:
+        raise Exception(f"pages_per_shard must be positive, got {pages_per_shard}")
+
+    page_count = int(pdfinfo_from_path(pdf_path)['Pages'])
+
+    shards = []
+    for first_page in range(1, page_count + 1, pages_per_shard):
+        shards.append({
+            'mode': 'shard',
+            'bucket': bucket,
+            'key': key,
+            'first_page': first_page,
+            'last_page': min(first_page + pages_per_shard - 1, page_count),
+            'dpi_mode': dpi_mode
+        })
+
+    logger.info(f"Planned {len(shards)} shards for {page_count} pages of {bucket}/{key}")
+
+    return {
+        'statusCode': 200,
+        'bucket': bucket,
+        'key': key,
+        'page_count': page_count,
+        'shards': shards
+    }
+
+def merge_shards(event):
+    """
+    Merge shard results into a single images list in page order
+
+    Args:
+        event: Merge event with bucket, key and shard_results
+
+    Returns:
+        Dict in the same format as a full conversion
+
+    Raises:
+        Exception: If any shard failed
+    """
+    shard_results = event.get('shard_results', [])
+
+    failed = [shard for shard in shard_results if shard.get('statusCode') != 200]
+    if failed:
+        errors = '; '.join(str(shard.get('error', 'unknown error')) for shard in failed)
+        raise Exception(f"{len(failed)} of {len(shard_results)} shards failed: {errors}")
+
+    image_keys = []
+    for shard in sorted(shard_results, key=lambda shard: shard['first_page']):
+        image_keys.extend(shard.get('images', []))
+
+    logger.info(f"Merged {len(shard_results)} shards into {len(image_keys)} images")
+
+    return {
+        'statusCode': 200,
+        'bucket': event['bucket'],
+        'key': event['key'],
+        'images': image_keys
+    }
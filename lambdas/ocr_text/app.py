@@ -1,13 +1,25 @@
 import json
 import os
 import tempfile
+import boto3
 import pytesseract
+from botocore.config import Config
 from PIL import Image
 from utils.logger import get_logger
 from utils.s3 import S3Client
 
 logger = get_logger(__name__)
 
+# Adaptively rendered pages scoring below this confidence are re-rendered once
+RERENDER_CONFIDENCE_THRESHOLD = float(os.getenv('RERENDER_CONFIDENCE_THRESHOLD', '60'))
+RERENDER_DPI_FACTOR = 1.5
+MAX_RENDER_DPI = int(os.getenv('MAX_RENDER_DPI', '300'))
+
+# Time kept back from the re-render invoke for the second OCR pass; if less
+# than MIN_RERENDER_SECONDS would remain for the invoke it is skipped
+OCR_RESERVE_SECONDS = 45
+MIN_RERENDER_SECONDS = 10
+
 def lambda_handler(event, context):
     """
     Extract text from images using OCR
@@ -19,7 +31,10 @@ def lambda_handler(event, context):
     {
         "image_key": "path/to/image.png",
         "text": "extracted_text_content",
-        "confidence": 85.5
+        "confidence": 85.5,
+        "dpi": 200,
+        "ocr_image_key": "path/to/image.png",
+        "rerendered": false
     }
     """
     try:
@@ -42,35 +57,46 @@ def lambda_handler(event, context):
             
             # Open image and perform OCR
             image = Image.open(image_path)
+            dpi = image_dpi(image)
+            extracted_text, avg_confidence, word_count = run_ocr(image)
+            ocr_image_key = image_key
+            rerendered = False
             
-            # Configure tesseract for better accuracy
-            custom_config = r'--oem 3 --psm 6'
-            
-            # Extract text
-            extracted_text = pytesseract.image_to_string(
-                image, 
-                config=custom_config
-            ).strip()
-            
-            # Get confidence score
-            try:
-                data = pytesseract.image_to_data(
-                    image, 
-                    output_type=pytesseract.Output.DICT,
-                    config=custom_config
+            # Re-render adaptively chosen pages whose recognised words scored
+            # poorly; blank, photo and QR-only pages have no words to improve
+            new_dpi = min(int(dpi * RERENDER_DPI_FACTOR), MAX_RENDER_DPI) if dpi else None
+            rerender_timeout = remaining_seconds(context) - OCR_RESERVE_SECONDS
+            if (word_count > 0
+                    and avg_confidence < RERENDER_CONFIDENCE_THRESHOLD
+                    and image.info.get('dpi_mode') == 'adaptive'
+                    and os.getenv('CONVERT_FUNCTION_NAME')
+                    and new_dpi and new_dpi > dpi
+                    and rerender_timeout >= MIN_RERENDER_SECONDS):
+                logger.info(f"Confidence {avg_confidence:.1f}% below threshold, re-rendering at {new_dpi} DPI")
+                
+                rerender_key = rerender_page(
+                    bucket, image.info['source_key'], int(image.info['page']), new_dpi, rerender_timeout
                 )
-                confidences = [int(conf) for conf in data['conf'] if int(conf) > 0]
-                avg_confidence = sum(confidences) / len(confidences) if confidences else 0
-            except:
-                avg_confidence = 0
+                if rerender_key:
+                    rerender_path = os.path.join(temp_dir, 'rerender.png')
+                    if s3_client.download_file(bucket, rerender_key, rerender_path):
+                        retry_text, retry_confidence, _ = run_ocr(Image.open(rerender_path))
+                        rerendered = True
+                        if retry_confidence > avg_confidence:
+                            extracted_text, avg_confidence = retry_text, retry_confidence
+                            ocr_image_key = rerender_key
+                            dpi = new_dpi
             
-            logger.info(f"Extracted text length: {len(extracted_text)}, confidence: {avg_confidence:.1f}%")
+            logger.info(f"Extracted text length: {len(extracted_text)}, confidence: {avg_confidence:.1f}%, dpi: {dpi}")
             
             return {
                 'statusCode': 200,
                 'image_key': image_key,
                 'text': extracted_text,
-                'confidence': round(avg_confidence, 1)
+                'confidence': round(avg_confidence, 1),
+                'dpi': dpi,
+                'ocr_image_key': ocr_image_key,
+                'rerendered': rerendered
             }
             
     except Exception as e:
@@ -82,3 +108,92 @@ def lambda_handler(event, context):
             'text': '',
             'confidence': 0
         }
+
+def run_ocr(image):
+    """
+    Extract text and average word confidence from an image
+    
+    Args:
+        image: PIL image
+    
+    Returns:
+        Tuple of extracted text, average confidence and recognised word count
+    """
+    # Configure tesseract for better accuracy
+    custom_config = r'--oem 3 --psm 6'
+    
+    # Extract text
+    extracted_text = pytesseract.image_to_string(
+        image, 
+        config=custom_config
+    ).strip()
+    
+    # Get confidence score
+    try:
+        data = pytesseract.image_to_data(
+            image, 
+            output_type=pytesseract.Output.DICT,
+            config=custom_config
+        )
+        confidences = [int(conf) for conf in data['conf'] if int(conf) > 0]
+        avg_confidence = sum(confidences) / len(confidences) if confidences else 0
+    except:
+        confidences = []
+        avg_confidence = 0
+    
+    return extracted_text, avg_confidence, len(confidences)
+
+def remaining_seconds(context):
+    """Seconds left before this invocation times out, or the full timeout when run locally"""
+    if context is None:
+        return 180
+    return context.get_remaining_time_in_millis() / 1000
+
+def image_dpi(image):
+    """
+    Read the render DPI recorded in the PNG by convert_to_image
+    
+    Returns:
+        DPI as an int, or None if the image carries no resolution
+    """
+    dpi = image.info.get('dpi')
+    return int(round(dpi[0])) if dpi else None
+
+def rerender_page(bucket, source_key, page, dpi, timeout):
+    """
+    Ask convert_to_image to re-render a single page to a separate image key
+    
+    Args:
+        bucket: S3 bucket name
+        source_key: S3 key of the source PDF
+        page: Page number (1-based)
+        dpi: New render DPI
+        timeout: Seconds to wait for convert_to_image before keeping the first pass
+    
+    Returns:
+        S3 key of the re-rendered image, or None if re-rendering failed or timed out
+    """
+    try:
+        # Bound the wait so a slow render of a large PDF can't time this function out
+        lambda_client = boto3.client('lambda', config=Config(
+            read_timeout=timeout,
+            retries={'max_attempts': 0}
+        ))
+        response = lambda_client.invoke(
+            FunctionName=os.environ['CONVERT_FUNCTION_NAME'],
+            Payload=json.dumps({
+                'mode': 'rerender',
+                'bucket': bucket,
+                'key': source_key,
+                'page': page,
+                'dpi': dpi
+            })
+        )
+        result = json.loads(response['Payload'].read())
+        if result.get('statusCode') != 200 or not result.get('images'):
+            logger.error(f"Re-render of {source_key} page {page} failed: {result.get('error')}")
+            return None
+        return result['images'][0]
+    except Exception as e:
+        logger.error(f"Failed to invoke re-render of {source_key} page {page}: {str(e)}")
+        return None
@@ -3,6 +3,7 @@ import os
 import boto3
 from datetime import datetime
 import uuid
+from utils.index import DocumentIndex
 from utils.logger import get_logger
 
 logger = get_logger(__name__)
@@ -34,9 +35,42 @@ def lambda_handler(event, context):
     {
         "statusCode": 200,
         "document_id": "uuid",
+        "indexed": true,
         "validation_results": {...}
     }
+    
+    Lookup event format (resolved from the inverted index, no table scan):
+    {
+        "action": "lookup",
+        "text": "invoice INV-2024-001",   # optional, all tokens must match
+        "qr_data": "INV-2024-001"         # optional, exact QR payload
+    }
+    
+    Returns:
+    {
+        "statusCode": 200,
+        "document_ids": ["uuid", ...]
+    }
+    
+    Reindex event format (for records stored with "indexed": false):
+    {
+        "action": "reindex",
+        "document_id": "uuid"
+    }
+    
+    Returns:
+    {
+        "statusCode": 200,
+        "document_id": "uuid",
+        "indexed": true
+    }
     """
+    if isinstance(event, dict) and event.get('action') == 'lookup':
+        return lookup_documents(event)
+    
+    if isinstance(event, dict) and event.get('action') == 'reindex':
+        return reindex_document(event)
+    
     try:
         logger.info(f"Validating processing results: {json.dumps(event, default=str)}")
         
@@ -57,9 +91,11 @@ def lambda_handler(event, context):
             'qr_data': qr_results.get('qr_results', []),
             'ocr_text': ocr_results.get('text', ''),
             'ocr_confidence': ocr_results.get('confidence', 0),
+            'render_dpi': ocr_results.get('dpi'),
             'validation_status': validation_results['status'],
             'validation_errors': validation_results['errors'],
-            'validation_score': validation_results['score']
+            'validation_score': validation_results['score'],
+            'indexed': False  # Set once the postings are written
         }
         
         # Store in DynamoDB
@@ -71,9 +107,14 @@ def lambda_handler(event, context):
         
         logger.info(f"Successfully stored validation results for document: {document_id}")
         
+        # Index OCR tokens and QR payloads; records left with indexed=false
+        # can be found and passed to the reindex action
+        record['indexed'] = index_record(table, record)
+        
         return {
             'statusCode': 200,
             'document_id': document_id,
+            'indexed': record['indexed'],
             'validation_results': validation_results,
             'stored_record': record
         }
@@ -85,6 +126,95 @@ def lambda_handler(event, context):
             'error': str(e)
         }
 
+def index_record(table, record):
+    """
+    Add a stored record to the inverted index and mark it as indexed
+    
+    Args:
+        table: DynamoDB results table
+        record: Stored record with document_id, ocr_text and qr_data
+    
+    Returns:
+        True if the record was indexed, False otherwise
+    """
+    document_id = record['document_id']
+    try:
+        DocumentIndex().add_document(document_id, record.get('ocr_text', ''), record.get('qr_data', []))
+        table.update_item(
+            Key={'document_id': document_id},
+            UpdateExpression='SET indexed = :indexed',
+            ExpressionAttributeValues={':indexed': True}
+        )
+        return True
+    except Exception as e:
+        logger.error(f"Failed to index document {document_id}, left as indexed=false: {str(e)}")
+        return False
+
+def reindex_document(event):
+    """
+    Re-run indexing for a stored record, e.g. one left with indexed=false
+    
+    Args:
+        event: Reindex event with document_id
+    
+    Returns:
+        Dict with status code and indexing result
+    """
+    try:
+        document_id = event['document_id']
+        table = boto3.resource('dynamodb').Table(os.environ['DYNAMODB_TABLE'])
+        
+        record = table.get_item(Key={'document_id': document_id}).get('Item')
+        if not record:
+            raise Exception(f"Document not found: {document_id}")
+        
+        indexed = index_record(table, record)
+        
+        return {
+            'statusCode': 200 if indexed else 500,
+            'document_id': document_id,
+            'indexed': indexed
+        }
+        
+    except Exception as e:
+        logger.error(f"Error reindexing document: {str(e)}")
+        return {
+            'statusCode': 500,
+            'error': str(e),
+            'indexed': False
+        }
+
+def lookup_documents(event):
+    """
+    Resolve document IDs from the inverted index
+    
+    Args:
+        event: Lookup event with optional text and qr_data
+    
+    Returns:
+        Dict with status code and matching document IDs
+    """
+    try:
+        text = event.get('text')
+        qr_data = event.get('qr_data')
+        if not text and not qr_data:
+            raise Exception("Lookup requires text or qr_data")
+        
+        document_ids = DocumentIndex().lookup(text=text, qr_data=qr_data)
+        
+        return {
+            'statusCode': 200,
+            'document_ids': sorted(document_ids)
+        }
+        
+    except Exception as e:
+        logger.error(f"Error looking up documents: {str(e)}")
+        return {
+            'statusCode': 500,
+            'error': str(e),
+            'document_ids': []
+        }
+
 def validate_extraction_data(qr_results, ocr_results):
     """
     Validate the extracted QR and OCR data
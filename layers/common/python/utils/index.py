@@ -0,0 +1,181 @@
+import boto3
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from typing import Iterable, Optional, Set
+import hashlib
+import os
+import re
+import time
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Tokens keep internal separators so identifiers like INV-2024-001 stay whole
+TOKEN_PATTERN = re.compile(r"\w+(?:[-./]\w+)*")
+
+MIN_TOKEN_LENGTH = 2
+MAX_TOKEN_LENGTH = 64
+
+# Attempts at writing a document's postings before add_document gives up
+INDEX_WRITE_ATTEMPTS = 3
+
+# QR payloads longer than this many UTF-8 bytes are stored by digest to stay
+# well under the 2048-byte partition key limit
+MAX_TERM_BYTES = 512
+
+# Very common words would make posting lists huge without narrowing a lookup
+STOPWORDS = frozenset([
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in',
+    'is', 'it', 'of', 'on', 'or', 'the', 'this', 'to', 'was', 'with'
+])
+
+def tokenize(text: str) -> Set[str]:
+    """
+    Split text into normalized, de-duplicated index tokens
+
+    Args:
+        text: Raw OCR or query text
+
+    Returns:
+        Set of case-folded tokens
+    """
+    tokens = set()
+    for token in TOKEN_PATTERN.findall((text or '').casefold()):
+        if MIN_TOKEN_LENGTH <= len(token) <= MAX_TOKEN_LENGTH and token not in STOPWORDS:
+            tokens.add(token)
+    return tokens
+
+def text_term(token: str) -> str:
+    """Index term for a normalized text token"""
+    return f"text#{token}"
+
+def qr_term(data: str) -> str:
+    """Index term for a QR payload, matched exactly after trimming whitespace"""
+    data = (data or '').strip()
+    if len(data.encode('utf-8')) > MAX_TERM_BYTES:
+        data = 'sha256:' + hashlib.sha256(data.encode('utf-8')).hexdigest()
+    return f"qr#{data}"
+
+class DocumentIndex:
+    """
+    Inverted index from text tokens and QR payloads to document IDs
+
+    Every posting is its own item keyed by term and document ID, so posting
+    lists grow without hitting the item size limit and adding a document
+    only writes that document's postings.
+    """
+
+    def __init__(self, table_name: Optional[str] = None):
+        self.table = boto3.resource('dynamodb').Table(table_name or os.environ['INDEX_TABLE'])
+
+    def document_terms(self, ocr_text: str, qr_data: Iterable[dict]) -> Set[str]:
+        """
+        Collect all index terms for a stored record
+
+        Args:
+            ocr_text: Extracted OCR text
+            qr_data: QR results as produced by qr_scanner
+
+        Returns:
+            Set of index terms
+        """
+        terms = {text_term(token) for token in tokenize(ocr_text)}
+        for qr in qr_data or []:
+            if qr.get('data', '').strip():
+                terms.add(qr_term(qr['data']))
+        return terms
+
+    def add_document(self, document_id: str, ocr_text: str, qr_data: Iterable[dict]) -> int:
+        """
+        Add a document's postings to the index
+
+        Args:
+            document_id: Stored document ID
+            ocr_text: Extracted OCR text
+            qr_data: QR results as produced by qr_scanner
+
+        Returns:
+            Number of terms indexed
+
+        Raises:
+            ClientError: If the postings could not be written after retrying
+        """
+        terms = self.document_terms(ocr_text, qr_data)
+
+        # Postings are idempotent puts, so a failed batch is simply rewritten
+        for attempt in range(1, INDEX_WRITE_ATTEMPTS + 1):
+            try:
+                with self.table.batch_writer() as batch:
+                    for term in terms:
+                        batch.put_item(Item={'term': term, 'document_id': document_id})
+                break
+            except ClientError as e:
+                if attempt == INDEX_WRITE_ATTEMPTS:
+                    raise
+                logger.warning(f"Indexing {document_id} failed (attempt {attempt}), retrying: {e}")
+                time.sleep(2 ** attempt * 0.5)
+
+        logger.info(f"Indexed {len(terms)} terms for document {document_id}")
+        return len(terms)
+
+    def lookup_term(self, term: str) -> Set[str]:
+        """
+        Resolve a single index term to its document IDs
+
+        Args:
+            term: Index term (see text_term and qr_term)
+
+        Returns:
+            Set of document IDs
+        """
+        document_ids = set()
+        query_args = {
+            'KeyConditionExpression': Key('term').eq(term),
+            'ProjectionExpression': 'document_id'
+        }
+
+        while True:
+            response = self.table.query(**query_args)
+            for item in response.get('Items', []):
+                document_ids.add(item['document_id'])
+            if 'LastEvaluatedKey' not in response:
+                break
+            query_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+        return document_ids
+
+    def lookup(self, text: Optional[str] = None, qr_data: Optional[str] = None) -> Set[str]:
+        """
+        Find documents whose OCR text contains every token of text and/or
+        that carry a QR code with exactly qr_data
+
+        Args:
+            text: Free text, tokenized the same way as indexed OCR text
+            qr_data: QR payload to match
+
+        Returns:
+            Set of matching document IDs
+
+        Raises:
+            Exception: If the query has no indexable tokens
+        """
+        terms = []
+        if text:
+            terms = [text_term(token) for token in tokenize(text)]
+            if not terms:
+                raise Exception(f"Query has no indexable tokens: {text!r}")
+        if qr_data and qr_data.strip():
+            terms.append(qr_term(qr_data))
+
+        if not terms:
+            raise Exception("Query has no indexable tokens")
+
+        result = None
+        for term in terms:
+            document_ids = self.lookup_term(term)
+            result = document_ids if result is None else result & document_ids
+            if not result:
+                break
+
+        logger.info(f"Index lookup for {len(terms)} terms matched {len(result)} documents")
+        return result
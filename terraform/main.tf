@@ -81,6 +81,29 @@ resource "aws_dynamodb_table" "document_results" {
   }
 }
 
+# DynamoDB Table for the inverted index over OCR tokens and QR payloads
+resource "aws_dynamodb_table" "document_index" {
+  name           = "${var.project_name}-index"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "term"
+  range_key      = "document_id"
+
+  attribute {
+    name = "term"
+    type = "S"
+  }
+
+  attribute {
+    name = "document_id"
+    type = "S"
+  }
+
+  tags = {
+    Name        = "${var.project_name}-index"
+    Environment = var.environment
+  }
+}
+
 # IAM Role for Lambda functions
 resource "aws_iam_role" "lambda_role" {
   name = "${var.project_name}-lambda-role"
@@ -131,9 +154,13 @@ resource "aws_iam_role_policy" "lambda_policy" {
           "dynamodb:GetItem",
           "dynamodb:Query",
           "dynamodb:Scan",
-          "dynamodb:UpdateItem"
+          "dynamodb:UpdateItem",
+          "dynamodb:BatchWriteItem"
+        ]
+        Resource = [
+          aws_dynamodb_table.document_results.arn,
+          aws_dynamodb_table.document_index.arn
         ]
-        Resource = aws_dynamodb_table.document_results.arn
       },
       {
         Effect = "Allow"
@@ -151,6 +178,13 @@ resource "aws_iam_role_policy" "lambda_policy" {
           "states:StartExecution"
         ]
         Resource = aws_sfn_state_machine.document_processor.arn
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "lambda:InvokeFunction"
+        ]
+        Resource = aws_lambda_function.convert_to_image.arn
       }
     ]
   })
@@ -374,12 +408,17 @@ resource "aws_sfn_state_machine" "document_processor" {
 
   definition = jsonencode({
     Comment = "Document processing pipeline"
-    StartAt = "ConvertToImage"
+    StartAt = "PlanShards"
     States = {
-      ConvertToImage = {
+      PlanShards = {
         Type = "Task"
         Resource = aws_lambda_function.convert_to_image.arn
-        Next = "ProcessImages"
+        Parameters = {
+          mode = "plan"
+          "bucket.$" = "$.bucket"
+          "key.$" = "$.key"
+        }
+        Next = "ConvertShards"
         Retry = [
           {
             ErrorEquals = ["Lambda.ServiceException", "Lambda.AWSLambdaException", "Lambda.SdkClientException"]
@@ -389,6 +428,48 @@ resource "aws_sfn_state_machine" "document_processor" {
           }
         ]
       }
+      ConvertShards = {
+        Type = "Map"
+        ItemsPath = "$.shards"
+        ResultPath = "$.shard_results"
+        MaxConcurrency = var.convert_max_concurrency
+        Iterator = {
+          StartAt = "ConvertShard"
+          States = {
+            ConvertShard = {
+              Type = "Task"
+              Resource = aws_lambda_function.convert_to_image.arn
+              End = true
+              Retry = [
+                {
+                  ErrorEquals = ["Lambda.ServiceException", "Lambda.AWSLambdaException", "Lambda.SdkClientException"]
+                  IntervalSeconds = 2
+                  MaxAttempts = 3
+                  BackoffRate = 2
+                },
+                {
+                  ErrorEquals = ["States.TaskFailed"]
+                  IntervalSeconds = 5
+                  MaxAttempts = 3
+                  BackoffRate = 2
+                }
+              ]
+            }
+          }
+        }
+        Next = "MergeShards"
+      }
+      MergeShards = {
+        Type = "Task"
+        Resource = aws_lambda_function.convert_to_image.arn
+        Parameters = {
+          mode = "merge"
+          "bucket.$" = "$.bucket"
+          "key.$" = "$.key"
+          "shard_results.$" = "$.shard_results"
+        }
+        Next = "ProcessImages"
+      }
       ProcessImages = {
         Type = "Map"
         ItemsPath = "$.images"
@@ -459,6 +540,9 @@ resource "aws_lambda_function" "convert_to_image" {
   environment {
     variables = {
       BUCKET_NAME = aws_s3_bucket.document_bucket.bucket
+      PAGES_PER_SHARD = var.pages_per_shard
+      RENDER_DPI_MODE = var.render_dpi_mode
+      MAX_RENDER_DPI = var.max_render_dpi
     }
   }
 }
@@ -502,7 +586,7 @@ resource "aws_lambda_function" "ocr_text" {
   role            = aws_iam_role.lambda_role.arn
   handler         = "app.lambda_handler"
   runtime         = "python3.12"
-  timeout         = 120
+  timeout         = 180
   memory_size     = 1024
   source_code_hash = data.archive_file.ocr_text.output_base64sha256
 
@@ -511,6 +595,9 @@ resource "aws_lambda_function" "ocr_text" {
   environment {
     variables = {
       BUCKET_NAME = aws_s3_bucket.document_bucket.bucket
+      CONVERT_FUNCTION_NAME = aws_lambda_function.convert_to_image.function_name
+      RERENDER_CONFIDENCE_THRESHOLD = var.rerender_confidence_threshold
+      MAX_RENDER_DPI = var.max_render_dpi
     }
   }
 }
@@ -538,6 +625,7 @@ resource "aws_lambda_function" "validator" {
     variables = {
       BUCKET_NAME = aws_s3_bucket.document_bucket.bucket
       DYNAMODB_TABLE = aws_dynamodb_table.document_results.name
+      INDEX_TABLE = aws_dynamodb_table.document_index.name
     }
   }
 }
@@ -17,3 +17,8 @@ output "upload_url" {
   description = "S3 URL for uploading documents"
   value       = "s3://${aws_s3_bucket.document_bucket.bucket}/uploads/"
 }
+
+output "index_table_name" {
+  description = "Name of the DynamoDB table holding the inverted index"
+  value       = aws_dynamodb_table.document_index.name
+}
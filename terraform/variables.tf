@@ -15,3 +15,38 @@ variable "environment" {
   type        = string
   default     = "dev"
 }
+
+variable "pages_per_shard" {
+  description = "Number of PDF pages rendered by each convert_to_image shard"
+  type        = number
+  default     = 50
+}
+
+variable "convert_max_concurrency" {
+  description = "Maximum number of convert_to_image shards rendered concurrently"
+  type        = number
+  default     = 10
+}
+
+variable "render_dpi_mode" {
+  description = "PDF render resolution mode: fixed (200 DPI) or adaptive (per-page DPI)"
+  type        = string
+  default     = "fixed"
+
+  validation {
+    condition     = contains(["fixed", "adaptive"], var.render_dpi_mode)
+    error_message = "render_dpi_mode must be either \"fixed\" or \"adaptive\"."
+  }
+}
+
+variable "max_render_dpi" {
+  description = "Highest DPI adaptive rendering and OCR re-renders may use"
+  type        = number
+  default     = 300
+}
+
+variable "rerender_confidence_threshold" {
+  description = "OCR confidence below which adaptively rendered pages are re-rendered at a higher DPI"
+  type        = number
+  default     = 60
+}